@@ -2,6 +2,7 @@ from flask import Flask, render_template, request, jsonify, redirect, url_for
 from datetime import datetime, timedelta
 import database
 import qr_generator
+import backup
 import config
 import os
 
@@ -11,6 +12,7 @@ app.config['SECRET_KEY'] = 'freshscan-secret-key-2024'
 # Initialize components
 try:
     db = database.db
+    db.init_tables()
     print("✅ Database module loaded successfully")
 except Exception as e:
     print(f"❌ Error loading database: {e}")
@@ -23,6 +25,13 @@ except Exception as e:
     print(f"❌ Error loading QR generator: {e}")
     qr = None
 
+try:
+    backups = backup.backup_manager
+    print("✅ Backup manager loaded successfully")
+except Exception as e:
+    print(f"❌ Error loading backup manager: {e}")
+    backups = None
+
 # ========================
 # USER FACING ROUTES (QR SCANNING)
 # ========================
@@ -177,6 +186,57 @@ def generate_all_qr():
                              message=f"Error generating QR codes: {str(e)}",
                              error_code="500")
 
+@app.route('/admin/backup', methods=['GET', 'POST'])
+def admin_backup():
+    """Start an online backup (POST) or list snapshots and the last report (GET)"""
+    if not backups:
+        return jsonify({'success': False, 'error': 'Backup manager not initialized'}), 500
+    
+    try:
+        if request.method == 'POST':
+            started = backups.start_backup()
+            if not started:
+                return jsonify({'success': False, 'error': 'A backup is already running'}), 409
+            return jsonify({'success': True, 'started': True}), 202
+        
+        return jsonify({
+            'success': True,
+            'running': backups.lock.locked(),
+            'snapshots': backups.list_backups(),
+            'last_report': backups.last_report
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# ========================
+# SYNC API (OFFLINE CLIENTS)
+# ========================
+
+@app.route('/api/sync')
+def api_sync():
+    """Delta sync - rows changed since a revision, for offline replicas"""
+    if not db:
+        return jsonify({'success': False, 'error': 'Database not initialized'}), 500
+    
+    bad_args = jsonify({'success': False,
+                        'error': 'since must be an integer >= 0 and limit an integer >= 1'}), 400
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', config.Config.SYNC_BATCH_SIZE))
+    except ValueError:
+        return bad_args
+    if since < 0 or limit < 1:
+        return bad_args
+    epoch = request.args.get('epoch')
+    limit = min(limit, config.Config.SYNC_MAX_BATCH_SIZE)
+    
+    try:
+        result = db.get_changes_since(since, limit, epoch)
+        result['success'] = True
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ========================
 # DEMO & TESTING ROUTES
 # ========================
@@ -0,0 +1,343 @@
+import sqlite3
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+import config
+import database
+
+SNAPSHOT_PREFIX = 'freshscan-'
+SNAPSHOT_SUFFIX = '.db.gz'
+
+class BackupRestartLimit(Exception):
+    """Raised from the progress callback to stop a backup that keeps restarting"""
+
+class BackupManager:
+    def __init__(self):
+        self.db_path = config.Config.DATABASE
+        self.backup_dir = config.Config.BACKUP_DIR
+        self.lock = threading.Lock()
+        self.last_report = None
+
+        # Create directories if they don't exist
+        os.makedirs(self.backup_dir, exist_ok=True)
+
+    def create_backup(self):
+        """Take a backup now, unless one is already running"""
+        if not self.lock.acquire(blocking=False):
+            return None
+
+        try:
+            return self.run_backup()
+        finally:
+            self.lock.release()
+
+    def start_backup(self):
+        """Run a backup in a background thread, so no request waits on it"""
+        if not self.lock.acquire(blocking=False):
+            return False
+
+        def worker():
+            try:
+                self.run_backup()
+            finally:
+                self.lock.release()
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return True
+
+    def snapshot_path_for(self, timestamp):
+        """Get an unused snapshot path for a timestamp"""
+        # The _NN suffix sorts after the plain name, so newest-first order holds
+        snapshot_path = os.path.join(
+            self.backup_dir, f'{SNAPSHOT_PREFIX}{timestamp}{SNAPSHOT_SUFFIX}')
+        count = 1
+        while os.path.exists(snapshot_path) or os.path.exists(snapshot_path + '.failed'):
+            snapshot_path = os.path.join(
+                self.backup_dir, f'{SNAPSHOT_PREFIX}{timestamp}_{count:02d}{SNAPSHOT_SUFFIX}')
+            count += 1
+        return snapshot_path
+
+    def run_backup(self):
+        """Copy the live database in small steps, then compress, verify and rotate.
+
+        The caller must hold self.lock.
+        """
+        started = time.monotonic()
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        snapshot_path = self.snapshot_path_for(timestamp)
+        raw_path = snapshot_path + '.partial'
+        temp_paths = [raw_path, snapshot_path + '.tmp']
+
+        try:
+            # Time spent inside backup steps is the time scans could be blocked;
+            # the pauses between steps are left out
+            held = {'seconds': 0.0, 'steps': 0, 'mark': time.monotonic(),
+                    'restarts': 0, 'remaining': None, 'total': None}
+
+            def progress(status, remaining, total):
+                held['seconds'] += time.monotonic() - held['mark']
+                held['steps'] += 1
+
+                # SQLite starts over when another connection writes to the
+                # source, which shows up as remaining going back up
+                if held['remaining'] is not None and (
+                        total != held['total'] or remaining > held['remaining']):
+                    held['restarts'] += 1
+                    if held['restarts'] > config.Config.BACKUP_MAX_RESTARTS:
+                        raise BackupRestartLimit()
+                held['remaining'] = remaining
+                held['total'] = total
+
+                time.sleep(config.Config.BACKUP_STEP_PAUSE)
+                held['mark'] = time.monotonic()
+
+            # Own connections, so the request threads' connections are untouched
+            source = sqlite3.connect(self.db_path)
+            target = sqlite3.connect(raw_path)
+            try:
+                try:
+                    source.backup(target,
+                                  pages=config.Config.BACKUP_PAGES_PER_STEP,
+                                  progress=progress)
+                except BackupRestartLimit:
+                    # Writes keep restarting the stepped copy; finish with one
+                    # full step, which holds the database for its whole length
+                    held['mark'] = time.monotonic()
+                    source.backup(target)
+                    held['seconds'] = time.monotonic() - held['mark']
+                    held['steps'] += 1
+            finally:
+                target.close()
+                source.close()
+
+            raw_size = os.path.getsize(raw_path)
+
+            # Compress to a temporary name so a snapshot file is always complete
+            with open(raw_path, 'rb') as src, gzip.open(snapshot_path + '.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(raw_path)
+            os.replace(snapshot_path + '.tmp', snapshot_path)
+
+            checksum = self.file_checksum(snapshot_path)
+            with open(snapshot_path + '.sha256', 'w') as f:
+                f.write(f'{checksum}  {os.path.basename(snapshot_path)}\n')
+
+            # A snapshot that fails verification is set aside and never
+            # counts toward retention, so it can't rotate out a good one
+            verification = self.verify_backup(snapshot_path)
+            removed = []
+            quarantined = None
+            if verification['ok']:
+                removed = self.rotate_backups()
+                database.db.compact_sync_log()
+            else:
+                quarantined = self.quarantine_backup(snapshot_path)
+
+            self.last_report = {
+                'file': quarantined or snapshot_path,
+                'created': timestamp,
+                'size_bytes': raw_size,
+                'compressed_bytes': os.path.getsize(quarantined or snapshot_path),
+                'sha256': checksum,
+                'steps': held['steps'],
+                'held_seconds': round(held['seconds'], 4),
+                'restarts': held['restarts'],
+                'elapsed_seconds': round(time.monotonic() - started, 4),
+                'verified': verification['ok'],
+                'error': verification['error'],
+                'rotated_out': removed
+            }
+
+            if verification['ok']:
+                print(f"✅ Backup written: {snapshot_path} "
+                      f"(held database {self.last_report['held_seconds']}s "
+                      f"over {held['steps']} steps, {held['restarts']} restarts)")
+            else:
+                print(f"❌ Backup failed verification: {verification['error']}")
+        except Exception as e:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+            self.last_report = {
+                'file': None,
+                'created': timestamp,
+                'elapsed_seconds': round(time.monotonic() - started, 4),
+                'verified': False,
+                'error': str(e),
+                'rotated_out': []
+            }
+            print(f"❌ Backup failed: {e}")
+
+        return self.last_report
+
+    def file_checksum(self, path):
+        """Get the SHA-256 of a file"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def decompress(self, snapshot_path, raw_path):
+        """Decompress a snapshot to a plain database file"""
+        with gzip.open(snapshot_path, 'rb') as src, open(raw_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+    def verify_backup(self, snapshot_path):
+        """Check a snapshot's checksum and that it opens as a sound database"""
+        checksum_path = snapshot_path + '.sha256'
+        if not os.path.exists(checksum_path):
+            return {'ok': False, 'error': 'Checksum file missing'}
+
+        try:
+            with open(checksum_path) as f:
+                fields = f.read().split()
+        except OSError as e:
+            return {'ok': False, 'error': str(e)}
+        if not fields:
+            return {'ok': False, 'error': 'Checksum file empty'}
+        if self.file_checksum(snapshot_path) != fields[0]:
+            return {'ok': False, 'error': 'Checksum mismatch'}
+
+        raw_path = snapshot_path + '.verify'
+        try:
+            self.decompress(snapshot_path, raw_path)
+            conn = sqlite3.connect(raw_path)
+            try:
+                result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+                if result != 'ok':
+                    return {'ok': False, 'error': f'Integrity check failed: {result}'}
+                for table in database.SYNC_TABLES:
+                    conn.execute(f'SELECT COUNT(*) FROM {table}')
+            finally:
+                conn.close()
+        except (OSError, sqlite3.DatabaseError) as e:
+            return {'ok': False, 'error': str(e)}
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+
+        return {'ok': True, 'error': None}
+
+    def list_backups(self):
+        """Get snapshot paths, newest first"""
+        names = [name for name in os.listdir(self.backup_dir)
+                 if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)]
+        return [os.path.join(self.backup_dir, name) for name in sorted(names, reverse=True)]
+
+    def quarantine_backup(self, snapshot_path):
+        """Move a bad snapshot out of the rotation, keeping it for inspection"""
+        failed_path = snapshot_path + '.failed'
+        os.replace(snapshot_path, failed_path)
+        if os.path.exists(snapshot_path + '.sha256'):
+            os.replace(snapshot_path + '.sha256', failed_path + '.sha256')
+        return failed_path
+
+    def rotate_backups(self):
+        """Delete snapshots beyond the retention count"""
+        removed = []
+        for path in self.list_backups()[config.Config.BACKUP_RETENTION:]:
+            os.remove(path)
+            if os.path.exists(path + '.sha256'):
+                os.remove(path + '.sha256')
+            removed.append(path)
+        return removed
+
+    def restore_backup(self, snapshot_path):
+        """Replace the live database with a verified snapshot"""
+        verification = self.verify_backup(snapshot_path)
+        if not verification['ok']:
+            raise ValueError(f"Refusing to restore {snapshot_path}: {verification['error']}")
+
+        raw_path = snapshot_path + '.restore'
+        try:
+            self.decompress(snapshot_path, raw_path)
+            previous_ids, previous_seqs = self.read_live_state()
+
+            source = sqlite3.connect(raw_path)
+            target = sqlite3.connect(self.db_path)
+            try:
+                # Restore is one full copy - it is meant to be exclusive
+                source.backup(target)
+                database.db.init_sync_log(target.cursor())
+                self.resync_after_restore(target, previous_ids, previous_seqs)
+            finally:
+                target.close()
+                source.close()
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+
+        print(f"✅ Database restored from {snapshot_path}")
+
+    def read_live_state(self):
+        """Get the live database's row ids and AUTOINCREMENT sequences.
+
+        Sync clients need these to learn about rows the snapshot doesn't
+        have. A missing database has nothing to track; a corrupt one is
+        kept aside, since SQLite can't restore over a file that isn't a
+        database. Anything else (e.g. a locked database) stops the restore.
+        """
+        previous_ids = {table: [] for table in database.SYNC_TABLES}
+        previous_seqs = {}
+        if not os.path.exists(self.db_path):
+            return previous_ids, previous_seqs
+
+        try:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+            try:
+                tables = {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'")}
+                for table in database.SYNC_TABLES:
+                    if table in tables:
+                        previous_ids[table] = [row[0] for row in conn.execute(f'SELECT id FROM {table}')]
+                if 'sqlite_sequence' in tables:
+                    previous_seqs = dict(conn.execute('SELECT name, seq FROM sqlite_sequence'))
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            raise
+        except sqlite3.DatabaseError:
+            os.replace(self.db_path, self.db_path + '.corrupt')
+            print(f"⚠️ Unreadable database moved to {self.db_path}.corrupt")
+
+        return previous_ids, previous_seqs
+
+    def resync_after_restore(self, conn, previous_ids, previous_seqs):
+        """Log every affected row again, above any revision clients have seen"""
+        # Ids and revisions must keep increasing: a reused product id would
+        # send already printed QR codes to another product, and a reused
+        # revision would make sync clients skip the restore
+        for name in list(database.SYNC_TABLES) + ['sync_log']:
+            seq = previous_seqs.get(name, 0)
+            updated = conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?',
+                                   (seq, name)).rowcount
+            if not updated and seq:
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (name, seq))
+
+        for table in database.SYNC_TABLES:
+            current_ids = [row[0] for row in conn.execute(f'SELECT id FROM {table}')]
+            for row_id in sorted(set(previous_ids[table]) | set(current_ids)):
+                conn.execute(
+                    "INSERT INTO sync_log (table_name, row_id, op) VALUES (?, ?, 'restore')",
+                    (table, row_id)
+                )
+        conn.commit()
+
+# Global instance
+backup_manager = BackupManager()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'restore':
+        backup_manager.restore_backup(sys.argv[2])
+    else:
+        report = backup_manager.create_backup()
+        for key, value in report.items():
+            print(f"   {key}: {value}")
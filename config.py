@@ -20,6 +20,17 @@ class Config:
     # Database configuration
     DATABASE = 'freshscan.db'
     
+    # Delta sync (offline kiosks / handhelds)
+    SYNC_BATCH_SIZE = 500
+    SYNC_MAX_BATCH_SIZE = 5000
+    
+    # Online backups
+    BACKUP_DIR = 'backups'
+    BACKUP_RETENTION = 7            # snapshots to keep
+    BACKUP_PAGES_PER_STEP = 64      # pages copied while holding the database
+    BACKUP_STEP_PAUSE = 0.005       # seconds between steps, lets scans run
+    BACKUP_MAX_RESTARTS = 3         # restarts (caused by writes) before one full copy
+    
     # Expiry thresholds (in days)
     NEAR_EXPIRY_THRESHOLD = 3
     EXPIRED_THRESHOLD = 0
@@ -2,10 +2,18 @@ import sqlite3
 from datetime import datetime, timedelta
 import config
 import threading
+import uuid
 
 # Use thread-local storage for database connections
 thread_local = threading.local()
 
+# Tables tracked by the sync change log, with the columns sent to clients
+SYNC_TABLES = {
+    'products': ['id', 'product_name', 'batch_id', 'category', 'mfg_date',
+                 'expiry_date', 'storage_instructions', 'added_date'],
+    'categories': ['id', 'name', 'icon']
+}
+
 class Database:
     def __init__(self):
         # Don't create connection here, create per thread
@@ -69,9 +77,157 @@ class Database:
             except:
                 pass
         
+        self.init_sync_log(cursor)
+        self.compact_sync_log(cursor)
+        
         conn.commit()
         print("✅ Database initialized successfully!")
     
+    def init_sync_log(self, cursor):
+        """Create the change log and the triggers that feed it"""
+        # Every write to a tracked table gets a new, increasing revision
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_log (
+                rev INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                op TEXT NOT NULL
+            )
+        ''')
+        # Only used by compact_sync_log; get_changes_since must not use it
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sync_log_row
+            ON sync_log (table_name, row_id)
+        ''')
+        
+        # Random id for this database's change log. Revisions only mean
+        # something within one epoch, so a recreated database gets a new one
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        cursor.execute(
+            "INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('epoch', ?)",
+            (uuid.uuid4().hex,)
+        )
+        
+        # Triggers also catch writes made outside this module
+        # (e.g. add_sample_products.py)
+        for table in SYNC_TABLES:
+            for op, ref in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS sync_{table}_{op.lower()}
+                    AFTER {op} ON {table}
+                    BEGIN
+                        INSERT INTO sync_log (table_name, row_id, op)
+                        VALUES ('{table}', {ref}.id, '{op.lower()}');
+                    END
+                ''')
+        
+        # Seed the log for databases created before sync existed,
+        # so a client starting from revision 0 gets every row
+        if cursor.execute('SELECT COUNT(*) FROM sync_log').fetchone()[0] == 0:
+            for table in SYNC_TABLES:
+                cursor.execute(f'''
+                    INSERT INTO sync_log (table_name, row_id, op)
+                    SELECT '{table}', id, 'insert' FROM {table} ORDER BY id
+                ''')
+    
+    def compact_sync_log(self, cursor=None):
+        """Delete log entries superseded by a later write to the same row"""
+        # get_changes_since only uses each row's latest revision, so
+        # clients at any revision get the same result afterwards
+        if cursor is None:
+            conn, cursor = self.get_connection()
+        cursor.execute('''
+            DELETE FROM sync_log WHERE rev NOT IN (
+                SELECT MAX(rev) FROM sync_log GROUP BY table_name, row_id
+            )
+        ''')
+        cursor.connection.commit()
+        return cursor.rowcount
+    
+    def get_current_revision(self):
+        """Get the latest change log revision (0 if nothing has changed)"""
+        conn, cursor = self.get_connection()
+        cursor.execute('SELECT COALESCE(MAX(rev), 0) FROM sync_log')
+        return cursor.fetchone()[0]
+    
+    def get_sync_epoch(self):
+        """Get the id of this database's change log"""
+        conn, cursor = self.get_connection()
+        cursor.execute("SELECT value FROM sync_meta WHERE key = 'epoch'")
+        return cursor.fetchone()[0]
+    
+    def get_changes_since(self, since, limit=config.Config.SYNC_BATCH_SIZE, epoch=None):
+        """Get rows changed after revision `since`, one entry per row.
+        
+        Several writes to the same row collapse into its latest state, so
+        the batch size depends on how many rows changed, not how often.
+        """
+        conn, cursor = self.get_connection()
+        
+        # A client from another epoch (or ahead of us) holds a replica of a
+        # database that was recreated; tell it to drop the replica and start over
+        current_epoch = self.get_sync_epoch()
+        reset = since > 0 and (epoch != current_epoch or
+                               since > self.get_current_revision())
+        if reset:
+            since = 0
+        
+        # Latest revision of each changed row, oldest first. Paging on that
+        # revision means a row never appears before a newer write to it.
+        # NOT INDEXED keeps this a range search on rev, so the cost follows
+        # the number of changes rather than the size of the log.
+        cursor.execute('''
+            SELECT table_name, row_id, MAX(rev) AS last_rev
+            FROM sync_log NOT INDEXED
+            WHERE rev > ?
+            GROUP BY table_name, row_id
+            ORDER BY last_rev
+            LIMIT ?
+        ''', (since, limit + 1))
+        entries = cursor.fetchall()
+        
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        
+        changes = {table: {'upserted': [], 'deleted': []} for table in SYNC_TABLES}
+        for table, columns in SYNC_TABLES.items():
+            row_ids = [row_id for name, row_id, _ in entries if name == table]
+            if not row_ids:
+                continue
+            
+            # Look up current state in chunks to stay under SQLite's variable limit
+            current = {}
+            for start in range(0, len(row_ids), 500):
+                chunk = row_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(
+                    f'SELECT {", ".join(columns)} FROM {table} WHERE id IN ({placeholders})',
+                    chunk
+                )
+                for row in cursor.fetchall():
+                    current[row[0]] = dict(zip(columns, row))
+            
+            # A row that no longer exists was deleted, whatever its last op was
+            for row_id in row_ids:
+                if row_id in current:
+                    changes[table]['upserted'].append(current[row_id])
+                else:
+                    changes[table]['deleted'].append(row_id)
+        
+        return {
+            'epoch': current_epoch,
+            'since': since,
+            'revision': entries[-1][2] if entries else since,
+            'has_more': has_more,
+            'reset': reset,
+            'changes': changes
+        }
+    
     def add_product(self, product_data):
         """Add a new product to database"""
         conn, cursor = self.get_connection()